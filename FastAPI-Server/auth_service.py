@@ -1,13 +1,24 @@
 import bcrypt
+import hashlib
 import jwt
+import logging
 from datetime import datetime, timedelta
-from typing import Tuple
+from typing import Optional, Tuple
 from uuid import uuid4
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from models import User, RefreshToken
 from config import settings
+from profiling import profile_section
+import revocation
 import re
 
+logger = logging.getLogger(__name__)
+
+# MySQL error codes raised through IntegrityError
+MYSQL_DUPLICATE_ENTRY = 1062
+MYSQL_FOREIGN_KEY_FAILED = 1452
+
 def parse_expiration_time(expires_in: str) -> timedelta:
     """Parse expiration time string like '15m', '7d' to timedelta"""
     match = re.match(r'(\d+)([mhd])', expires_in.lower())
@@ -25,18 +36,30 @@ def parse_expiration_time(expires_in: str) -> timedelta:
         raise ValueError(f"Unknown time unit: {unit}")
 
 def hash_password(password: str) -> str:
-    """Hash password using bcrypt"""
-    salt = bcrypt.gensalt(rounds=12)
-    return bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
+    """Hash password using bcrypt with the configured cost"""
+    salt = bcrypt.gensalt(rounds=settings.BCRYPT_ROUNDS)
+    with profile_section('bcrypt'):
+        return bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
+
+def get_hash_rounds(password_hash: str) -> int:
+    """Extract the bcrypt cost factor from a hash like '$2b$12$...'"""
+    try:
+        return int(password_hash.split('$')[2])
+    except (IndexError, ValueError):
+        raise ValueError("Invalid password hash format")
+
+def needs_rehash(password_hash: str) -> bool:
+    """Check if a stored hash was made with a different cost than configured"""
+    return get_hash_rounds(password_hash) != settings.BCRYPT_ROUNDS
 
 def verify_password(password: str, password_hash: str) -> bool:
     """Verify password against hash"""
-    return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
+    with profile_section('bcrypt'):
+        return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
 
 def hash_token(token: str) -> str:
-    """Hash token using bcrypt"""
-    salt = bcrypt.gensalt(rounds=10)
-    return bcrypt.hashpw(token.encode('utf-8'), salt).decode('utf-8')
+    """Hash token using SHA-256 (tokens are random and signed, so a slow hash adds nothing)"""
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
 
 def generate_access_token(user_id: int, email: str) -> str:
     """Generate access JWT token"""
@@ -47,25 +70,30 @@ def generate_access_token(user_id: int, email: str) -> str:
     }
     return jwt.encode(payload, settings.JWT_ACCESS_SECRET, algorithm='HS256')
 
-def generate_refresh_token(user_id: int) -> Tuple[str, str, datetime]:
-    """Generate refresh JWT token with JTI"""
+def generate_refresh_token(user_id: int, email: str, family_id: str) -> Tuple[str, str, datetime]:
+    """Generate refresh JWT token with JTI, carrying what a refresh needs to skip DB reads"""
     jti = str(uuid4())
     expires_in = parse_expiration_time(settings.JWT_REFRESH_EXPIRES_IN)
     expires_at = datetime.utcnow() + expires_in
     
     payload = {
         'sub': str(user_id),
+        'email': email,
         'jti': jti,
+        'fam': family_id,
         'exp': expires_at
     }
     token = jwt.encode(payload, settings.JWT_REFRESH_SECRET, algorithm='HS256')
     return token, jti, expires_at
 
-def persist_refresh_token(db: Session, user_id: int, token: str, jti: str, expires_at: datetime):
+def persist_refresh_token(db: Session, user_id: int, token: str, jti: str, expires_at: datetime,
+                          family_id: str, parent_jti: Optional[str] = None):
     """Store refresh token hash in database"""
     token_hash = hash_token(token)
     refresh_token = RefreshToken(
         jti=jti,
+        family_id=family_id,
+        parent_jti=parent_jti,
         token_hash=token_hash,
         user_id=user_id,
         expires_at=expires_at
@@ -73,6 +101,18 @@ def persist_refresh_token(db: Session, user_id: int, token: str, jti: str, expir
     db.add(refresh_token)
     db.commit()
 
+def issue_tokens(db: Session, user: User):
+    """Issue an access token and the first refresh token of a new token family"""
+    access_token = generate_access_token(user.id, user.email)
+    family_id = str(uuid4())
+    refresh_token, jti, expires_at = generate_refresh_token(user.id, user.email, family_id)
+    persist_refresh_token(db, user.id, refresh_token, jti, expires_at, family_id)
+    
+    return {
+        'user': {'id': user.id, 'email': user.email},
+        'tokens': {'accessToken': access_token, 'refreshToken': refresh_token}
+    }
+
 def register_user(db: Session, email: str, password: str):
     """Register new user"""
     # Check if user already exists
@@ -88,14 +128,7 @@ def register_user(db: Session, email: str, password: str):
     db.refresh(user)
     
     # Generate tokens
-    access_token = generate_access_token(user.id, user.email)
-    refresh_token, jti, expires_at = generate_refresh_token(user.id)
-    persist_refresh_token(db, user.id, refresh_token, jti, expires_at)
-    
-    return {
-        'user': {'id': user.id, 'email': user.email},
-        'tokens': {'accessToken': access_token, 'refreshToken': refresh_token}
-    }
+    return issue_tokens(db, user)
 
 def login_user(db: Session, email: str, password: str):
     """Login user with email and password"""
@@ -103,47 +136,81 @@ def login_user(db: Session, email: str, password: str):
     if not user or not verify_password(password, user.password_hash):
         raise ValueError("Invalid credentials")
     
-    # Generate tokens
-    access_token = generate_access_token(user.id, user.email)
-    refresh_token, jti, expires_at = generate_refresh_token(user.id)
-    persist_refresh_token(db, user.id, refresh_token, jti, expires_at)
+    # Upgrade (or downgrade) the stored hash when the configured cost changed
+    if needs_rehash(user.password_hash):
+        user.password_hash = hash_password(password)
+        db.commit()
     
-    return {
-        'user': {'id': user.id, 'email': user.email},
-        'tokens': {'accessToken': access_token, 'refreshToken': refresh_token}
-    }
+    # Generate tokens
+    return issue_tokens(db, user)
+
+def integrity_error_code(error: IntegrityError) -> Optional[int]:
+    """Get the MySQL error code behind an IntegrityError"""
+    args = getattr(error.orig, 'args', ())
+    return args[0] if args and isinstance(args[0], int) else None
+
+def is_token_reuse(error: IntegrityError) -> bool:
+    """Check if an IntegrityError is a duplicate parent_jti, i.e. a token rotated twice"""
+    return integrity_error_code(error) == MYSQL_DUPLICATE_ENTRY and 'parent_jti' in str(error.orig)
 
 def refresh_session(db: Session, refresh_token: str):
-    """Refresh user session with refresh token"""
+    """Rotate a refresh token, revoking its family if it was already used"""
     try:
         payload = jwt.decode(refresh_token, settings.JWT_REFRESH_SECRET, algorithms=['HS256'])
     except jwt.InvalidTokenError:
         raise ValueError("Invalid refresh token")
     
     user_id = payload.get('sub')
+    email = payload.get('email')
     jti = payload.get('jti')
+    family_id = payload.get('fam')
     
-    if not user_id or not jti:
+    # Tokens issued before rotation was introduced carry no family and need a new login
+    if not user_id or not email or not jti or not family_id:
         raise ValueError("Invalid refresh token payload")
     
-    # Check if token exists and is not revoked
-    token_record = db.query(RefreshToken).filter(RefreshToken.jti == jti).first()
-    if not token_record or token_record.revoked:
+    if revocation.cache.is_revoked(family_id):
         raise ValueError("Refresh token revoked or missing")
     
-    user = db.query(User).filter(User.id == int(user_id)).first()
-    if not user:
-        raise ValueError("User not found")
+    # parent_jti is unique, so only the first rotation of a token can insert its successor
+    new_refresh_token, new_jti, expires_at = generate_refresh_token(int(user_id), email, family_id)
+    try:
+        persist_refresh_token(db, int(user_id), new_refresh_token, new_jti, expires_at, family_id, parent_jti=jti)
+    except IntegrityError as e:
+        db.rollback()
+        if is_token_reuse(e):
+            logger.warning(f"Refresh token reuse detected for user {user_id}, revoking token family {family_id}")
+            revoke_token_family(db, family_id)
+            raise ValueError("Refresh token revoked or missing")
+        if integrity_error_code(e) == MYSQL_FOREIGN_KEY_FAILED:
+            raise ValueError("User not found")
+        raise ValueError("Invalid refresh token")
     
-    # Generate new access token
-    access_token = generate_access_token(user.id, user.email)
+    access_token = generate_access_token(int(user_id), email)
     
     return {
-        'user': {'id': user.id, 'email': user.email},
-        'tokens': {'accessToken': access_token, 'refreshToken': refresh_token}
+        'user': {'id': int(user_id), 'email': email},
+        'tokens': {'accessToken': access_token, 'refreshToken': new_refresh_token}
     }
 
+def revoke_token_family(db: Session, family_id: str):
+    """Revoke every refresh token rotated from the same login"""
+    db.query(RefreshToken).filter(RefreshToken.family_id == family_id).update(
+        {'revoked': True, 'revoked_at': datetime.utcnow()}, synchronize_session=False
+    )
+    db.commit()
+    revocation.channel.publish([family_id])
+
 def revoke_tokens_for_user(db: Session, user_id: int):
     """Revoke all refresh tokens for a user"""
-    db.query(RefreshToken).filter(RefreshToken.user_id == user_id).update({'revoked': True})
+    family_ids = [
+        row.family_id for row in db.query(RefreshToken.family_id).filter(
+            RefreshToken.user_id == user_id,
+            RefreshToken.revoked == False
+        ).distinct()
+    ]
+    db.query(RefreshToken).filter(RefreshToken.user_id == user_id).update(
+        {'revoked': True, 'revoked_at': datetime.utcnow()}, synchronize_session=False
+    )
     db.commit()
+    revocation.channel.publish(family_ids)
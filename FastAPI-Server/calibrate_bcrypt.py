@@ -0,0 +1,53 @@
+"""
+Calibration script to pick the bcrypt cost factor for this machine
+"""
+import argparse
+import time
+import bcrypt
+from config import settings
+
+MIN_ROUNDS = 10
+MAX_ROUNDS = 16
+
+def measure_hash_ms(rounds: int, samples: int = 3) -> float:
+    """Measure the median time in milliseconds to hash a password at the given cost"""
+    password = b"calibration-password"
+    timings = []
+    for _ in range(samples):
+        salt = bcrypt.gensalt(rounds=rounds)
+        start = time.perf_counter()
+        bcrypt.hashpw(password, salt)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return timings[len(timings) // 2]
+
+def calibrate(target_ms: int, samples: int = 3) -> int:
+    """Return the highest cost whose hash time stays within target_ms (at least MIN_ROUNDS)"""
+    chosen = MIN_ROUNDS
+    for rounds in range(MIN_ROUNDS, MAX_ROUNDS + 1):
+        elapsed = measure_hash_ms(rounds, samples)
+        print(f"  rounds={rounds:<3} {elapsed:8.1f} ms")
+        if elapsed > target_ms:
+            if rounds == MIN_ROUNDS:
+                print(f"⚠ Even the minimum cost of {MIN_ROUNDS} takes longer than {target_ms} ms "
+                      f"on this machine; the target cannot be met without weakening hashes further")
+            break
+        chosen = rounds
+    return chosen
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pick BCRYPT_ROUNDS for a target per-hash latency")
+    parser.add_argument("--target-ms", type=int, default=settings.BCRYPT_TARGET_MS,
+                        help="Target time for a single password hash in milliseconds")
+    parser.add_argument("--samples", type=int, default=3,
+                        help="Number of hashes measured per cost factor")
+    args = parser.parse_args()
+
+    print(f"Calibrating bcrypt for a target of {args.target_ms} ms per hash...")
+    rounds = calibrate(args.target_ms, args.samples)
+
+    print(f"\n✓ Recommended cost factor: {rounds} (currently {settings.BCRYPT_ROUNDS})")
+    print("Add this to your .env file:")
+    print(f"  BCRYPT_ROUNDS={rounds}")
+    if rounds != settings.BCRYPT_ROUNDS:
+        print("\nExisting password hashes are upgraded automatically on the next successful login.")
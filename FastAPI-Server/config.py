@@ -1,4 +1,5 @@
 import os
+from pydantic import Field
 from pydantic_settings import BaseSettings
 import urllib.parse
 from dotenv import load_dotenv
@@ -8,6 +9,16 @@ load_dotenv()
 
 class Settings(BaseSettings):
     PORT: int = int(os.getenv("PORT", 4000))
+    HOST: str = os.getenv("HOST", "0.0.0.0")
+    # Server settings used by serve.py
+    WORKERS: int = int(os.getenv("WORKERS", os.cpu_count() or 1))
+    UVICORN_LOOP: str = os.getenv("UVICORN_LOOP", "auto")  # auto picks uvloop when installed
+    UVICORN_HTTP: str = os.getenv("UVICORN_HTTP", "auto")  # auto picks httptools when installed
+    BACKLOG: int = int(os.getenv("BACKLOG", 2048))
+    KEEPALIVE_TIMEOUT: int = int(os.getenv("KEEPALIVE_TIMEOUT", 5))
+    GRACEFUL_TIMEOUT: int = int(os.getenv("GRACEFUL_TIMEOUT", 30))
+    # Create the database and tables when the app starts (serve.py does this once before forking)
+    DB_INIT_ON_STARTUP: bool = os.getenv("DB_INIT_ON_STARTUP", "true").lower() == "true"
     # Database connection details
     DB_HOST: str = os.getenv("DB_HOST", "localhost")
     DB_PORT: int = int(os.getenv("DB_PORT", 3306))
@@ -19,6 +30,23 @@ class Settings(BaseSettings):
     JWT_REFRESH_SECRET: str = os.getenv("JWT_REFRESH_SECRET", "your_refresh_secret_key_here")
     JWT_ACCESS_EXPIRES_IN: str = os.getenv("JWT_ACCESS_EXPIRES_IN", "15m")
     JWT_REFRESH_EXPIRES_IN: str = os.getenv("JWT_REFRESH_EXPIRES_IN", "7d")
+    # Password hashing settings (run calibrate_bcrypt.py to pick BCRYPT_ROUNDS for this host)
+    # bcrypt only accepts costs from 4 to 31, so reject anything else at startup
+    BCRYPT_ROUNDS: int = Field(int(os.getenv("BCRYPT_ROUNDS", 12)), ge=4, le=31, validate_default=True)
+    BCRYPT_TARGET_MS: int = int(os.getenv("BCRYPT_TARGET_MS", 250))
+    # Refresh token revocation sync between workers ("database" polling or "local")
+    REVOCATION_CHANNEL: str = os.getenv("REVOCATION_CHANNEL", "database")
+    REVOCATION_POLL_INTERVAL: float = float(os.getenv("REVOCATION_POLL_INTERVAL", 2.0))
+    # Idempotency-Key settings for message sends
+    IDEMPOTENCY_KEY_EXPIRES_IN: str = os.getenv("IDEMPOTENCY_KEY_EXPIRES_IN", "24h")
+    IDEMPOTENCY_CACHE_SIZE: int = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", 10000))
+    # Request profiling settings (off unless enabled or a signing secret is set)
+    PROFILING_ENABLED: bool = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+    PROFILING_SAMPLE_RATE: float = float(os.getenv("PROFILING_SAMPLE_RATE", 0.01))
+    PROFILING_SECRET: str = os.getenv("PROFILING_SECRET", "")
+    PROFILING_DIR: str = os.getenv("PROFILING_DIR", "profiles")
+    # At least one profile must be kept, otherwise the directory would never be pruned
+    PROFILING_MAX_FILES: int = Field(int(os.getenv("PROFILING_MAX_FILES", 50)), ge=1, validate_default=True)
     
     @property
     def database_url(self) -> str:
@@ -0,0 +1,100 @@
+from typing import Optional
+from sqlalchemy.dialects.mysql import insert
+from sqlalchemy.orm import Session
+from models import Conversation, Message
+
+PREVIEW_LENGTH = 100
+
+def make_preview(content: str) -> str:
+    """Shorten message content for the conversation list"""
+    if len(content) <= PREVIEW_LENGTH:
+        return content
+    return content[:PREVIEW_LENGTH - 3] + '...'
+
+def record_message_created(db: Session, message: Message):
+    """Upsert the conversation summary for a newly created (flushed) message"""
+    stmt = insert(Conversation).values(
+        user_id=message.user_id,
+        sender_email=message.sender_email,
+        sender_name=message.sender_name,
+        last_message_id=message.id,
+        last_message_preview=make_preview(message.content),
+        last_message_at=message.created_at,
+        message_count=1,
+        unread_count=0 if message.is_read else 1
+    )
+    stmt = stmt.on_duplicate_key_update(
+        sender_name=stmt.inserted.sender_name,
+        last_message_id=stmt.inserted.last_message_id,
+        last_message_preview=stmt.inserted.last_message_preview,
+        last_message_at=stmt.inserted.last_message_at,
+        message_count=Conversation.message_count + 1,
+        unread_count=Conversation.unread_count + stmt.inserted.unread_count
+    )
+    db.execute(stmt)
+
+def set_message_read(db: Session, message: Message):
+    """Mark a message read and decrement its conversation's unread count exactly once"""
+    # Conditional update so concurrent calls cannot both see the message as unread
+    flipped = db.query(Message).filter(
+        Message.id == message.id,
+        Message.is_read == False
+    ).update({'is_read': True}, synchronize_session=False)
+    if flipped != 1:
+        return
+
+    db.query(Conversation).filter(
+        Conversation.user_id == message.user_id,
+        Conversation.sender_email == message.sender_email,
+        Conversation.unread_count > 0
+    ).update({'unread_count': Conversation.unread_count - 1}, synchronize_session=False)
+
+def record_message_deleted(db: Session, message: Message):
+    """Update the conversation summary for a message that is being deleted.
+
+    The message must have been loaded with_for_update() so is_read cannot change underneath.
+    """
+    conversation = db.query(Conversation).filter(
+        Conversation.user_id == message.user_id,
+        Conversation.sender_email == message.sender_email
+    ).with_for_update().first()
+    if not conversation:
+        return
+
+    if conversation.message_count <= 1:
+        db.delete(conversation)
+        return
+
+    conversation.message_count -= 1
+    if not message.is_read and conversation.unread_count > 0:
+        conversation.unread_count -= 1
+
+    # Only the latest message affects the preview, so only then look up its predecessor
+    if conversation.last_message_id == message.id:
+        previous = db.query(Message).filter(
+            Message.user_id == message.user_id,
+            Message.sender_email == message.sender_email,
+            Message.id < message.id
+        ).order_by(Message.id.desc()).first()
+        if previous:
+            conversation.last_message_id = previous.id
+            conversation.last_message_preview = make_preview(previous.content)
+            conversation.last_message_at = previous.created_at
+
+def get_conversations(db: Session, user_id: int):
+    """List conversations for a user, most recent first"""
+    return db.query(Conversation).filter(
+        Conversation.user_id == user_id
+    ).order_by(Conversation.last_message_at.desc()).all()
+
+def get_conversation_messages(db: Session, conversation: Conversation, limit: int, before_id: Optional[int] = None):
+    """Fetch one page of messages in a conversation, newest first"""
+    query = db.query(Message).filter(
+        Message.user_id == conversation.user_id,
+        Message.sender_email == conversation.sender_email
+    )
+    if before_id:
+        query = query.filter(Message.id < before_id)
+    messages = query.order_by(Message.id.desc()).limit(limit).all()
+    next_before_id = messages[-1].id if len(messages) == limit else None
+    return messages, next_before_id
@@ -35,9 +35,6 @@ def create_database_if_not_exists():
             print(f"Database '{settings.DB_NAME}' already exists")
         conn.commit()
 
-# Create the database if it doesn't exist
-create_database_if_not_exists()
-
 # Now create the main engine with the database
 engine = create_engine(
     url,
@@ -61,5 +58,6 @@ def get_db():
         db.close()
 
 def init_db():
-    """Initialize database by creating all tables"""
+    """Initialize database by creating it if needed and creating all tables"""
+    create_database_if_not_exists()
     Base.metadata.create_all(bind=engine)
@@ -0,0 +1,132 @@
+import hashlib
+import json
+import random
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Optional, Set, Tuple
+from sqlalchemy.orm import Session
+from models import IdempotencyKey, Message
+from schemas import MessageCreate, MessageResponse
+from auth_service import parse_expiration_time
+from config import settings
+
+# Fraction of new keys that also trigger a purge of expired rows
+PURGE_PROBABILITY = 0.01
+PURGE_BATCH_SIZE = 1000
+
+class IdempotencyMismatchError(ValueError):
+    """Raised when a key is replayed with a different request body"""
+
+class IdempotencyCache:
+    """Bounded per-process LRU of recent cache keys to their request hash and original response.
+
+    Entries are keyed by the raw recipient identifier so a hit needs no database query.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._by_message: Dict[int, Set[str]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, cache_key: str, request_hash: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is None:
+                return None
+            expires_at, stored_request_hash, response = entry
+            if expires_at <= datetime.utcnow():
+                self._remove(cache_key)
+                return None
+            self._entries.move_to_end(cache_key)
+        if stored_request_hash != request_hash:
+            raise IdempotencyMismatchError("Idempotency key was already used with a different request")
+        return response
+
+    def put(self, cache_key: str, expires_at: datetime, request_hash: str, response: dict):
+        with self._lock:
+            if cache_key in self._entries:
+                self._remove(cache_key)
+            self._entries[cache_key] = (expires_at, request_hash, response)
+            self._by_message.setdefault(response['id'], set()).add(cache_key)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def evict_message(self, message_id: int):
+        """Drop every entry that replays the given message"""
+        with self._lock:
+            for cache_key in list(self._by_message.get(message_id, ())):
+                self._remove(cache_key)
+
+    def _remove(self, cache_key: str):
+        _, _, response = self._entries.pop(cache_key)
+        keys = self._by_message.get(response['id'])
+        if keys is not None:
+            keys.discard(cache_key)
+            if not keys:
+                del self._by_message[response['id']]
+
+cache = IdempotencyCache(settings.IDEMPOTENCY_CACHE_SIZE)
+
+def hash_key(user_id: int, key: str) -> str:
+    """Hash an Idempotency-Key header, scoped to the recipient, into a fixed-size lookup key"""
+    return hashlib.sha256(f"{user_id}:{key}".encode('utf-8')).hexdigest()
+
+def hash_cache_key(secret_code: Optional[str], user_id: Optional[str], key: str) -> str:
+    """Hash the raw recipient query values and Idempotency-Key into a front cache key"""
+    raw = json.dumps([secret_code, user_id, key], separators=(',', ':'))
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+def hash_request(request: MessageCreate) -> str:
+    """Fingerprint a message request body"""
+    body = json.dumps(request.model_dump(mode='json'), sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(body.encode('utf-8')).hexdigest()
+
+def find_replay(db: Session, key_hash: str, request_hash: str) -> Optional[Tuple[Message, datetime]]:
+    """Find the message created for a key and the key's expiry, dropping the key if it has expired"""
+    record = db.query(IdempotencyKey).filter(IdempotencyKey.key_hash == key_hash).first()
+    if not record:
+        return None
+    if record.expires_at <= datetime.utcnow():
+        db.delete(record)
+        db.flush()
+        return None
+    if record.request_hash != request_hash:
+        raise IdempotencyMismatchError("Idempotency key was already used with a different request")
+
+    message = db.query(Message).filter(Message.id == record.message_id).first()
+    if not message:
+        raise ValueError("Idempotency key already used for a deleted message")
+    return message, record.expires_at
+
+def remember(cache_key: str, expires_at: datetime, request_hash: str, message: Message) -> dict:
+    """Serialize the response for a key and keep it in the front cache"""
+    response = MessageResponse.model_validate(message).model_dump()
+    cache.put(cache_key, expires_at, request_hash, response)
+    return response
+
+def record_key(db: Session, key_hash: str, request_hash: str, message: Message) -> datetime:
+    """Store the key for a newly created (flushed) message in the same transaction"""
+    expires_at = datetime.utcnow() + parse_expiration_time(settings.IDEMPOTENCY_KEY_EXPIRES_IN)
+    db.add(IdempotencyKey(
+        key_hash=key_hash,
+        request_hash=request_hash,
+        message_id=message.id,
+        expires_at=expires_at
+    ))
+    if random.random() < PURGE_PROBABILITY:
+        purge_expired_keys(db)
+    return expires_at
+
+def purge_expired_keys(db: Session):
+    """Delete a batch of expired keys"""
+    expired_ids = [
+        row.id for row in db.query(IdempotencyKey.id).filter(
+            IdempotencyKey.expires_at <= datetime.utcnow()
+        ).limit(PURGE_BATCH_SIZE)
+    ]
+    if expired_ids:
+        db.query(IdempotencyKey).filter(
+            IdempotencyKey.id.in_(expired_ids)
+        ).delete(synchronize_session=False)
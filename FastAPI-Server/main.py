@@ -1,29 +1,48 @@
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Query, Header, Response, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from database import get_db, init_db
+from database import get_db, init_db, engine
 from config import settings
 from schemas import (
     UserRegister, UserLogin, TokenRefresh, AuthResponse,
     LogoutRequest, HealthResponse, MessageCreate, MessageResponse, 
-    MessageMarkRead, SecretCodeAuth, UserIdResponse
+    MessageMarkRead, SecretCodeAuth, UserIdResponse,
+    ConversationResponse, ConversationMessagesResponse
 )
 from auth_service import register_user, login_user, refresh_session, revoke_tokens_for_user
-from models import Message, User
-import uvicorn
+from conversation_service import (
+    record_message_created, set_message_read, record_message_deleted,
+    get_conversations, get_conversation_messages
+)
+from idempotency import (
+    cache as idempotency_cache, IdempotencyMismatchError,
+    hash_key, hash_cache_key, hash_request, find_replay, record_key, remember
+)
+from models import Message, User, Conversation
+from profiling import install_profiling
+from revocation import start_revocation_sync, stop_revocation_sync
 import logging
-from typing import List
+from contextlib import asynccontextmanager
+from typing import List, Optional
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize database
-init_db()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Initialize database and revocation sync on startup, release resources on shutdown"""
+    if settings.DB_INIT_ON_STARTUP:
+        init_db()
+    start_revocation_sync()
+    yield
+    stop_revocation_sync()
+    engine.dispose()
 
 # Create FastAPI app
-app = FastAPI(title="Auth Server", version="0.1.0")
+app = FastAPI(title="Auth Server", version="0.1.0", lifespan=lifespan)
 
 # Middleware
 app.add_middleware(
@@ -36,6 +55,9 @@ app.add_middleware(
 
 app.add_middleware(TrustedHostMiddleware, allowed_hosts=["*"])
 
+# Opt-in request profiling (no-op unless PROFILING_ENABLED or PROFILING_SECRET is set)
+install_profiling(app, engine)
+
 # Error handling
 class HTTPErrorDetail:
     """Custom HTTP error response"""
@@ -142,9 +164,29 @@ async def set_secret_code(user_id: int, request: SecretCodeAuth, db: Session = D
 
 # Message Routes
 @app.post("/api/messages", response_model=MessageResponse, status_code=201)
-async def create_message(request: MessageCreate, user_id: str = None, secret_code: str = None, db: Session = Depends(get_db)):
-    """Create a new message for a user (identified by secret code or user ID)"""
+async def create_message(
+    request: MessageCreate,
+    response: Response,
+    user_id: str = None,
+    secret_code: str = None,
+    idempotency_key: Optional[str] = Header(None, max_length=255),
+    db: Session = Depends(get_db)
+):
+    """Create a new message for a user (identified by secret code or user ID).
+    
+    Requests repeating an Idempotency-Key header for the same recipient and body return the
+    original message instead of creating a duplicate.
+    """
     try:
+        # Hot retries are answered from the per-worker cache before any database query
+        if idempotency_key:
+            request_hash = hash_request(request)
+            cache_key = hash_cache_key(secret_code, user_id, idempotency_key)
+            cached = idempotency_cache.get(cache_key, request_hash)
+            if cached:
+                response.headers["Idempotent-Replayed"] = "true"
+                return cached
+        
         # Find user by secret_code or user_id
         user = None
         if secret_code:
@@ -158,6 +200,14 @@ async def create_message(request: MessageCreate, user_id: str = None, secret_cod
         if not user:
             raise HTTPException(status_code=404, detail="User not found with that secret code or user ID")
         
+        # Stored keys are scoped to the recipient and bound to the request body
+        key_hash = hash_key(user.id, idempotency_key) if idempotency_key else None
+        if key_hash:
+            replay = find_replay(db, key_hash, request_hash)
+            if replay:
+                response.headers["Idempotent-Replayed"] = "true"
+                return remember(cache_key, replay[1], request_hash, replay[0])
+        
         # Create message
         message = Message(
             sender_name=request.sender_name,
@@ -167,11 +217,34 @@ async def create_message(request: MessageCreate, user_id: str = None, secret_cod
             user_id=user.id
         )
         db.add(message)
-        db.commit()
+        db.flush()
+        record_message_created(db, message)
+        if not key_hash:
+            db.commit()
+            db.refresh(message)
+            return message
+        
+        expires_at = record_key(db, key_hash, request_hash, message)
+        try:
+            db.commit()
+        except IntegrityError:
+            # A concurrent request with the same key won the race
+            db.rollback()
+            replay = find_replay(db, key_hash, request_hash)
+            if not replay:
+                raise
+            response.headers["Idempotent-Replayed"] = "true"
+            return remember(cache_key, replay[1], request_hash, replay[0])
         db.refresh(message)
-        return message
+        return remember(cache_key, expires_at, request_hash, message)
     except HTTPException:
         raise
+    except IdempotencyMismatchError as e:
+        db.rollback()
+        raise HTTPException(status_code=422, detail=str(e))
+    except ValueError as e:
+        db.rollback()
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=400, detail=str(e))
@@ -208,7 +281,7 @@ async def mark_message_read(message_id: int, db: Session = Depends(get_db)):
         if not message:
             raise HTTPException(status_code=404, detail="Message not found")
         
-        message.is_read = True
+        set_message_read(db, message)
         db.commit()
         return {"message": "Message marked as read"}
     except HTTPException:
@@ -221,12 +294,15 @@ async def mark_message_read(message_id: int, db: Session = Depends(get_db)):
 async def delete_message(message_id: int, db: Session = Depends(get_db)):
     """Delete a message"""
     try:
-        message = db.query(Message).filter(Message.id == message_id).first()
+        # Lock the row so a concurrent mark-read cannot change is_read before the summary update
+        message = db.query(Message).filter(Message.id == message_id).with_for_update().first()
         if not message:
             raise HTTPException(status_code=404, detail="Message not found")
         
+        record_message_deleted(db, message)
         db.delete(message)
         db.commit()
+        idempotency_cache.evict_message(message_id)
         return {"message": "Message deleted"}
     except HTTPException:
         raise
@@ -234,10 +310,55 @@ async def delete_message(message_id: int, db: Session = Depends(get_db)):
         db.rollback()
         raise HTTPException(status_code=400, detail=str(e))
 
+# Conversation Routes
+@app.get("/api/conversations/{user_id}", response_model=List[ConversationResponse])
+async def list_conversations(user_id: str, db: Session = Depends(get_db)):
+    """Get one summary row per sender for a user (identified by secret code or user ID)"""
+    try:
+        user = db.query(User).filter(User.secret_code == user_id).first()
+        if not user and user_id.isdigit():
+            user = db.query(User).filter(User.id == int(user_id)).first()
+        
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+        
+        return get_conversations(db, user.id)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/conversations/{user_id}/{conversation_id}/messages", response_model=ConversationMessagesResponse)
+async def list_conversation_messages(
+    user_id: str,
+    conversation_id: int,
+    limit: int = Query(50, ge=1, le=200),
+    before_id: Optional[int] = None,
+    db: Session = Depends(get_db)
+):
+    """Get a page of messages from one sender, newest first"""
+    try:
+        user = db.query(User).filter(User.secret_code == user_id).first()
+        if not user and user_id.isdigit():
+            user = db.query(User).filter(User.id == int(user_id)).first()
+        
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+        
+        conversation = db.query(Conversation).filter(
+            Conversation.id == conversation_id,
+            Conversation.user_id == user.id
+        ).first()
+        if not conversation:
+            raise HTTPException(status_code=404, detail="Conversation not found")
+        
+        messages, next_before_id = get_conversation_messages(db, conversation, limit, before_id)
+        return {"messages": messages, "next_before_id": next_before_id}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 if __name__ == "__main__":
-    uvicorn.run(
-        app,
-        host="0.0.0.0",
-        port=settings.PORT,
-        log_level="info"
-    )
+    from serve import run
+    run()
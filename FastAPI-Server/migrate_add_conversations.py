@@ -0,0 +1,56 @@
+"""
+Migration script to create the conversations summary table and backfill it from existing messages
+"""
+from database import engine, init_db
+from sqlalchemy import text
+from conversation_service import PREVIEW_LENGTH
+
+def backfill_conversations():
+    """Create the conversations table and rebuild its rows from the messages table"""
+    try:
+        # Creates the conversations table if it is missing
+        init_db()
+
+        with engine.connect() as conn:
+            # create_all does not add indexes to an existing messages table
+            result = conn.execute(text("""
+                SELECT COUNT(*) as count
+                FROM information_schema.STATISTICS
+                WHERE TABLE_SCHEMA = DATABASE()
+                AND TABLE_NAME = 'messages'
+                AND INDEX_NAME = 'ix_messages_user_sender'
+            """))
+            if result.fetchone()[0] == 0:
+                conn.execute(text("CREATE INDEX ix_messages_user_sender ON messages (user_id, sender_email)"))
+                print("✓ Added index 'ix_messages_user_sender' to messages table")
+
+            conn.execute(text("DELETE FROM conversations"))
+
+            # One-off aggregate; afterwards the table is maintained on every message change.
+            # Previews are truncated the same way as conversation_service.make_preview.
+            result = conn.execute(text("""
+                INSERT INTO conversations
+                    (user_id, sender_email, sender_name, last_message_id,
+                     last_message_preview, last_message_at, message_count, unread_count)
+                SELECT m.user_id, m.sender_email, m.sender_name, m.id,
+                       CASE WHEN CHAR_LENGTH(m.content) <= :preview_length THEN m.content
+                            ELSE CONCAT(LEFT(m.content, :preview_length - 3), '...') END,
+                       m.created_at, s.message_count, s.unread_count
+                FROM (
+                    SELECT user_id, sender_email, MAX(id) AS last_id,
+                           COUNT(*) AS message_count,
+                           SUM(CASE WHEN is_read THEN 0 ELSE 1 END) AS unread_count
+                    FROM messages
+                    GROUP BY user_id, sender_email
+                ) s
+                JOIN messages m ON m.id = s.last_id
+            """), {'preview_length': PREVIEW_LENGTH})
+            conn.commit()
+
+            print(f"✓ Backfilled {result.rowcount} conversations from existing messages")
+
+    except Exception as e:
+        print(f"Error backfilling conversations: {e}")
+
+if __name__ == "__main__":
+    backfill_conversations()
@@ -0,0 +1,62 @@
+"""
+Migration script to add token family columns to the refresh_tokens table
+"""
+from database import engine
+from sqlalchemy import text
+
+COLUMNS = {
+    'family_id': "ADD COLUMN family_id VARCHAR(36) NULL",
+    'parent_jti': "ADD COLUMN parent_jti VARCHAR(255) NULL UNIQUE",
+    'revoked_at': "ADD COLUMN revoked_at DATETIME NULL",
+}
+
+INDEXES = {
+    'ix_refresh_tokens_family_id': "CREATE INDEX ix_refresh_tokens_family_id ON refresh_tokens (family_id)",
+    'ix_refresh_tokens_revoked_at': "CREATE INDEX ix_refresh_tokens_revoked_at ON refresh_tokens (revoked_at)",
+}
+
+def add_rotation_columns():
+    """Add family_id, parent_jti and revoked_at columns to refresh_tokens table"""
+    try:
+        with engine.connect() as conn:
+            for column, ddl in COLUMNS.items():
+                result = conn.execute(text("""
+                    SELECT COUNT(*) as count
+                    FROM information_schema.COLUMNS
+                    WHERE TABLE_SCHEMA = DATABASE()
+                    AND TABLE_NAME = 'refresh_tokens'
+                    AND COLUMN_NAME = :column
+                """), {'column': column})
+                if result.fetchone()[0] > 0:
+                    print(f"Column '{column}' already exists in refresh_tokens table")
+                    continue
+                conn.execute(text(f"ALTER TABLE refresh_tokens {ddl}"))
+                print(f"✓ Added '{column}' column to refresh_tokens table")
+
+            # Existing tokens each become their own family; revoked ones keep counting as revoked
+            conn.execute(text("UPDATE refresh_tokens SET family_id = jti WHERE family_id IS NULL"))
+            conn.execute(text("""
+                UPDATE refresh_tokens SET revoked_at = created_at
+                WHERE revoked = 1 AND revoked_at IS NULL
+            """))
+            conn.execute(text("ALTER TABLE refresh_tokens MODIFY family_id VARCHAR(36) NOT NULL"))
+
+            for index, ddl in INDEXES.items():
+                result = conn.execute(text("""
+                    SELECT COUNT(*) as count
+                    FROM information_schema.STATISTICS
+                    WHERE TABLE_SCHEMA = DATABASE()
+                    AND TABLE_NAME = 'refresh_tokens'
+                    AND INDEX_NAME = :index
+                """), {'index': index})
+                if result.fetchone()[0] == 0:
+                    conn.execute(text(ddl))
+                    print(f"✓ Added index '{index}' to refresh_tokens table")
+
+            conn.commit()
+
+    except Exception as e:
+        print(f"Error migrating refresh_tokens table: {e}")
+
+if __name__ == "__main__":
+    add_rotation_columns()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Text
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Text, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from database import Base
@@ -15,14 +15,20 @@ class User(Base):
     
     refresh_tokens = relationship("RefreshToken", back_populates="user", cascade="all, delete-orphan")
     messages = relationship("Message", back_populates="user", cascade="all, delete-orphan")
+    conversations = relationship("Conversation", back_populates="user", cascade="all, delete-orphan")
 
 class RefreshToken(Base):
     __tablename__ = "refresh_tokens"
     
     id = Column(Integer, primary_key=True, index=True)
     jti = Column(String(255), unique=True, index=True, nullable=False)
+    # All tokens rotated from one login share a family; reusing a rotated token revokes the family
+    family_id = Column(String(36), index=True, nullable=False)
+    # Unique so that a token can be rotated only once
+    parent_jti = Column(String(255), unique=True, nullable=True)
     token_hash = Column(String(255), nullable=False)
     revoked = Column(Boolean, default=False, nullable=False)
+    revoked_at = Column(DateTime, index=True, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     expires_at = Column(DateTime, nullable=False)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
@@ -42,4 +48,43 @@ class Message(Base):
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     
     user = relationship("User", back_populates="messages")
+    
+    __table_args__ = (
+        # Per-conversation fetches filter on (user_id, sender_email) and page by id
+        Index("ix_messages_user_sender", "user_id", "sender_email"),
+    )
 
+class Conversation(Base):
+    """Inbox summary with one row per (recipient, sender), maintained on message changes"""
+    __tablename__ = "conversations"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    sender_email = Column(String(255), nullable=False)
+    sender_name = Column(String(255), nullable=False)
+    last_message_id = Column(Integer, nullable=True)
+    last_message_preview = Column(String(255), nullable=True)
+    last_message_at = Column(DateTime, nullable=True)
+    message_count = Column(Integer, default=0, nullable=False)
+    unread_count = Column(Integer, default=0, nullable=False)
+    
+    user = relationship("User", back_populates="conversations")
+    
+    __table_args__ = (
+        UniqueConstraint("user_id", "sender_email", name="uq_conversations_user_sender"),
+        Index("ix_conversations_user_last_message", "user_id", "last_message_at"),
+    )
+
+
+class IdempotencyKey(Base):
+    """Record of a processed Idempotency-Key, kept until expires_at"""
+    __tablename__ = "idempotency_keys"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    # SHA-256 of the recipient user id and the Idempotency-Key header
+    key_hash = Column(String(64), unique=True, index=True, nullable=False)
+    # SHA-256 of the request body, so a key cannot be replayed with different content
+    request_hash = Column(String(64), nullable=False)
+    message_id = Column(Integer, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    expires_at = Column(DateTime, index=True, nullable=False)
@@ -0,0 +1,213 @@
+"""
+Opt-in per-request profiling.
+
+Requests are profiled when PROFILING_ENABLED is set (sampled by
+PROFILING_SAMPLE_RATE) or when they carry a valid signed X-Profile header.
+Each profile records a cProfile dump, SQL statements with timings and the
+time spent in bcrypt, and is written to a bounded directory of recent profiles.
+
+SQL timings and bcrypt time are tracked per request. The cProfile dump covers
+the event-loop thread while the request is in flight, so it also includes any
+other requests the loop served meanwhile; the JSON summary records how many
+(`interleaved_requests`), and a dump is only attributable to one request when
+that count is 0.
+"""
+import cProfile
+import hashlib
+import hmac
+import json
+import logging
+import os
+import random
+import re
+import sys
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+from sqlalchemy import event
+from starlette.concurrency import run_in_threadpool
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = b"x-profile"
+
+# Per-request profile data, None when the current request is not profiled
+_current_profile: ContextVar[Optional[dict]] = ContextVar("current_profile", default=None)
+
+# cProfile can only run one profiler at a time, so requests arriving while one runs
+# are not profiled themselves (their work still shows up in the running profile)
+_profiler_busy = False
+
+# Requests currently being handled and, while profiling, how many others ran alongside
+_in_flight = 0
+_interleaved = 0
+
+def profiling_active() -> bool:
+    """Check if profiling can be triggered at all"""
+    return settings.PROFILING_ENABLED or bool(settings.PROFILING_SECRET)
+
+def sign_profile_request(path: str, ttl_seconds: int = 300) -> str:
+    """Build an X-Profile header value for the given path"""
+    expires = int(time.time()) + ttl_seconds
+    signature = hmac.new(
+        settings.PROFILING_SECRET.encode('utf-8'),
+        f"{expires}:{path}".encode('utf-8'),
+        hashlib.sha256
+    ).hexdigest()
+    return f"{expires}.{signature}"
+
+def verify_profile_header(value: str, path: str) -> bool:
+    """Verify a signed X-Profile header value"""
+    if not settings.PROFILING_SECRET:
+        return False
+    try:
+        expires_str, signature = value.split('.', 1)
+        expires = int(expires_str)
+    except ValueError:
+        return False
+    if expires < time.time():
+        return False
+    expected = hmac.new(
+        settings.PROFILING_SECRET.encode('utf-8'),
+        f"{expires}:{path}".encode('utf-8'),
+        hashlib.sha256
+    ).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+@contextmanager
+def profile_section(name: str):
+    """Accumulate time spent in a named section (e.g. bcrypt) for the current profile"""
+    profile = _current_profile.get()
+    if profile is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        sections = profile['sections']
+        sections[name] = sections.get(name, 0.0) + elapsed_ms
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current_profile.get() is not None:
+        conn.info.setdefault('profile_query_start', []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _current_profile.get()
+    if profile is None:
+        return
+    starts = conn.info.get('profile_query_start')
+    if not starts:
+        return
+    elapsed_ms = (time.perf_counter() - starts.pop()) * 1000
+    profile['sql'].append({'statement': statement, 'duration_ms': round(elapsed_ms, 3)})
+
+def _should_profile(scope) -> bool:
+    if settings.PROFILING_SECRET:
+        for name, value in scope.get('headers', []):
+            if name == PROFILE_HEADER:
+                return verify_profile_header(value.decode('latin-1'), scope['path'])
+    if settings.PROFILING_ENABLED:
+        return random.random() < settings.PROFILING_SAMPLE_RATE
+    return False
+
+def _write_profile(profiler: cProfile.Profile, profile: dict):
+    """Write a profile to disk and evict the oldest ones beyond PROFILING_MAX_FILES"""
+    os.makedirs(settings.PROFILING_DIR, exist_ok=True)
+    slug = re.sub(r'[^A-Za-z0-9]+', '_', profile['path']).strip('_') or 'root'
+    stem = os.path.join(
+        settings.PROFILING_DIR,
+        f"{time.time_ns()}-{os.getpid()}-{profile['method']}-{slug}"
+    )
+    profiler.dump_stats(stem + '.prof')
+    with open(stem + '.json', 'w') as f:
+        json.dump(profile, f, indent=2)
+
+    stems = sorted({name.rsplit('.', 1)[0] for name in os.listdir(settings.PROFILING_DIR)})
+    for old in stems[:-settings.PROFILING_MAX_FILES]:
+        for ext in ('.prof', '.json'):
+            try:
+                os.remove(os.path.join(settings.PROFILING_DIR, old + ext))
+            except FileNotFoundError:
+                pass
+
+class ProfilingMiddleware:
+    """ASGI middleware that profiles sampled or explicitly requested requests"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        global _in_flight, _interleaved
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        _in_flight += 1
+        try:
+            if _profiler_busy or not _should_profile(scope):
+                if _profiler_busy:
+                    _interleaved += 1
+                await self.app(scope, receive, send)
+            else:
+                await self._profile(scope, receive, send)
+        finally:
+            _in_flight -= 1
+
+    async def _profile(self, scope, receive, send):
+        global _profiler_busy, _interleaved
+
+        profile = {
+            'method': scope['method'],
+            'path': scope['path'],
+            'status': None,
+            'sections': {},
+            'sql': [],
+        }
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                profile['status'] = message['status']
+            await send(message)
+
+        _profiler_busy = True
+        # Requests already in flight will also run on the loop while this one is profiled
+        _interleaved = _in_flight - 1
+        token = _current_profile.set(profile)
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profiler.disable()
+            profile['duration_ms'] = round((time.perf_counter() - start) * 1000, 3)
+            profile['interleaved_requests'] = _interleaved
+            _current_profile.reset(token)
+            _profiler_busy = False
+            try:
+                await run_in_threadpool(_write_profile, profiler, profile)
+            except OSError as e:
+                logger.warning(f"Failed to write profile: {e}")
+
+def install_profiling(app, engine):
+    """Attach the profiling middleware and SQL timing hooks when profiling is configured"""
+    if not profiling_active():
+        return
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    app.add_middleware(ProfilingMiddleware)
+    logger.info(
+        f"Request profiling installed (enabled={settings.PROFILING_ENABLED}, "
+        f"sample_rate={settings.PROFILING_SAMPLE_RATE}, dir={settings.PROFILING_DIR})"
+    )
+
+if __name__ == "__main__":
+    # Print a signed X-Profile header value for a request path
+    if len(sys.argv) != 2 or not settings.PROFILING_SECRET:
+        print("Usage: PROFILING_SECRET=... python profiling.py /api/messages/6789")
+        sys.exit(1)
+    print(f"X-Profile: {sign_profile_request(sys.argv[1])}")
@@ -0,0 +1,143 @@
+"""
+In-process revocation cache for refresh-token families.
+
+Refresh requests check the cache instead of the database. Revocations are
+written to the refresh_tokens table and announced through an invalidation
+channel so every worker's cache converges:
+
+- "local": only this process is notified (single worker)
+- "database": other workers poll refresh_tokens.revoked_at (default)
+
+Other transports (e.g. Redis pub/sub) can be added to CHANNELS.
+"""
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional
+from sqlalchemy import func
+from config import settings
+from database import SessionLocal
+from models import RefreshToken
+
+logger = logging.getLogger(__name__)
+
+def refresh_token_lifetime() -> timedelta:
+    # Imported lazily to avoid a circular import with auth_service
+    from auth_service import parse_expiration_time
+    return parse_expiration_time(settings.JWT_REFRESH_EXPIRES_IN)
+
+class RevocationCache:
+    """Set of revoked token families, each kept until its tokens must have expired"""
+
+    def __init__(self):
+        self._families: Dict[str, datetime] = {}
+        self._lock = threading.Lock()
+
+    def add(self, family_ids: Iterable[str], revoked_at: Optional[datetime] = None):
+        keep_until = (revoked_at or datetime.utcnow()) + refresh_token_lifetime()
+        with self._lock:
+            for family_id in family_ids:
+                self._families[family_id] = max(keep_until, self._families.get(family_id, keep_until))
+
+    def is_revoked(self, family_id: str) -> bool:
+        return family_id in self._families
+
+    def prune(self):
+        """Drop families whose tokens have all expired"""
+        now = datetime.utcnow()
+        with self._lock:
+            for family_id in [f for f, until in self._families.items() if until <= now]:
+                del self._families[family_id]
+
+    def load(self, db):
+        """Load families that still have unexpired revoked tokens"""
+        rows = db.query(RefreshToken.family_id, func.max(RefreshToken.revoked_at)).filter(
+            RefreshToken.revoked == True,
+            RefreshToken.expires_at > datetime.utcnow()
+        ).group_by(RefreshToken.family_id).all()
+        for family_id, revoked_at in rows:
+            self.add([family_id], revoked_at)
+        logger.info(f"Loaded {len(rows)} revoked refresh token families")
+
+class LocalRevocationChannel:
+    """Applies revocations to this process only"""
+
+    def __init__(self, cache: RevocationCache):
+        self.cache = cache
+
+    def publish(self, family_ids: Iterable[str]):
+        self.cache.add(family_ids)
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+class DatabasePollingChannel(LocalRevocationChannel):
+    """Picks up revocations made by other workers by polling refresh_tokens.revoked_at"""
+
+    def __init__(self, cache: RevocationCache, interval: float = settings.REVOCATION_POLL_INTERVAL):
+        super().__init__(cache)
+        self.interval = interval
+        self._since = datetime.utcnow()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="revocation-poller", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread:
+            self._thread.join(timeout=self.interval)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as e:
+                logger.warning(f"Failed to poll token revocations: {e}")
+
+    def poll(self):
+        # Overlap windows so revocations committed late are not missed; re-adding is harmless
+        started = datetime.utcnow()
+        db = SessionLocal()
+        try:
+            rows = db.query(RefreshToken.family_id, func.max(RefreshToken.revoked_at)).filter(
+                RefreshToken.revoked_at > self._since - timedelta(seconds=self.interval)
+            ).group_by(RefreshToken.family_id).all()
+        finally:
+            db.close()
+        for family_id, revoked_at in rows:
+            self.cache.add([family_id], revoked_at)
+        self.cache.prune()
+        self._since = started
+
+CHANNELS = {
+    "local": LocalRevocationChannel,
+    "database": DatabasePollingChannel,
+}
+
+if settings.REVOCATION_CHANNEL not in CHANNELS:
+    raise ValueError(
+        f"Unknown REVOCATION_CHANNEL '{settings.REVOCATION_CHANNEL}', "
+        f"expected one of: {', '.join(CHANNELS)}"
+    )
+
+cache = RevocationCache()
+channel = CHANNELS[settings.REVOCATION_CHANNEL](cache)
+
+def start_revocation_sync():
+    """Load current revocations and start listening for new ones"""
+    db = SessionLocal()
+    try:
+        cache.load(db)
+    finally:
+        db.close()
+    channel.start()
+
+def stop_revocation_sync():
+    channel.stop()
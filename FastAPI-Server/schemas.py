@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr, Field
-from typing import Optional
+from typing import Optional, List
 from datetime import datetime
 
 class UserRegister(BaseModel):
@@ -59,3 +59,19 @@ class UserIdResponse(BaseModel):
     user_id: int
     email: str
 
+
+class ConversationResponse(BaseModel):
+    id: int
+    sender_name: str
+    sender_email: str
+    last_message_preview: Optional[str]
+    last_message_at: Optional[datetime]
+    message_count: int
+    unread_count: int
+    
+    class Config:
+        from_attributes = True
+
+class ConversationMessagesResponse(BaseModel):
+    messages: List[MessageResponse]
+    next_before_id: Optional[int]
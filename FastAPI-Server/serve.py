@@ -0,0 +1,48 @@
+"""
+Production entry point running the app under multiple uvicorn workers
+"""
+import importlib.util
+import logging
+import os
+import uvicorn
+from config import settings
+from database import init_db, engine
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def describe_backend(setting: str, module: str) -> str:
+    """Describe which implementation uvicorn will pick for an 'auto' setting"""
+    if setting != "auto":
+        return setting
+    return f"auto ({module} {'available' if importlib.util.find_spec(module) else 'not installed'})"
+
+def run():
+    """Initialize the database once, then start the worker processes"""
+    init_db()
+    # Workers are spawned as fresh processes and open their own connection pools
+    engine.dispose()
+    # Spawned workers read the environment; with WORKERS=1 the app runs in this process
+    os.environ["DB_INIT_ON_STARTUP"] = "false"
+    settings.DB_INIT_ON_STARTUP = False
+
+    logger.info(
+        f"Starting {settings.WORKERS} worker(s) on {settings.HOST}:{settings.PORT} "
+        f"(loop={describe_backend(settings.UVICORN_LOOP, 'uvloop')}, "
+        f"http={describe_backend(settings.UVICORN_HTTP, 'httptools')})"
+    )
+    uvicorn.run(
+        "main:app",
+        host=settings.HOST,
+        port=settings.PORT,
+        workers=settings.WORKERS,
+        loop=settings.UVICORN_LOOP,
+        http=settings.UVICORN_HTTP,
+        backlog=settings.BACKLOG,
+        timeout_keep_alive=settings.KEEPALIVE_TIMEOUT,
+        timeout_graceful_shutdown=settings.GRACEFUL_TIMEOUT,
+        log_level="info"
+    )
+
+if __name__ == "__main__":
+    run()
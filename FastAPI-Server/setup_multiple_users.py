@@ -4,7 +4,7 @@ Setup script to create multiple users with different secret codes
 from sqlalchemy.orm import Session
 from database import SessionLocal, init_db
 from models import User
-import bcrypt
+from auth_service import hash_password
 
 def create_users():
     """Create multiple users with different secret codes"""
@@ -40,7 +40,7 @@ def create_users():
                 continue
             
             # Create new user
-            password_hash = bcrypt.hashpw(user_data["password"].encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+            password_hash = hash_password(user_data["password"])
             
             user = User(
                 email=user_data["email"],
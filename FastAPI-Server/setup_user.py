@@ -4,7 +4,7 @@ Setup script to create a test user with secret code
 from sqlalchemy.orm import Session
 from database import SessionLocal, init_db
 from models import User
-import bcrypt
+from auth_service import hash_password
 
 def create_test_user():
     """Create a test user with secret code 6789"""
@@ -26,7 +26,7 @@ def create_test_user():
         
         # Create new user
         password = "testpassword123"
-        password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        password_hash = hash_password(password)
         
         user = User(
             email="testuser@example.com",